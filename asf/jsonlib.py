@@ -0,0 +1,45 @@
+"""Fast json encoding and decoding.
+
+Uses orjson if it is installed and falls back to the standard library
+json module if it is not. :func:`dumps` always returns utf-8 encoded
+bytes and :func:`loads` accepts both bytes and strings.
+"""
+import datetime
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+    import json
+
+
+if orjson is not None:
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def dumps(obj):
+        """Return obj as json encoded bytes."""
+        return orjson.dumps(obj)
+
+    def loads(data):
+        """Return the object encoded in the json string or bytes data."""
+        return orjson.loads(data)
+
+else:  # pragma: no cover
+    JSONDecodeError = ValueError
+
+    def _default(obj):
+        if isinstance(obj, (datetime.date, datetime.time)):
+            return obj.isoformat()
+        raise TypeError('Type is not JSON serializable: {}'.format(
+            type(obj).__name__))
+
+    def dumps(obj):
+        """Return obj as json encoded bytes."""
+        return json.dumps(obj, default=_default,
+                          separators=(',', ':')).encode('utf-8')
+
+    def loads(data):
+        """Return the object encoded in the json string or bytes data."""
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8')
+        return json.loads(data)
@@ -1,23 +1,48 @@
 """The abstract salad bar model."""
 import logging
+import uuid
 
 from BTrees.OOBTree import BTree
 
-from dateutil import tz
+import persistent
 
-import iso8601
 
-import persistent
+log = logging.getLogger(__name__)
 
-import shortuuid
+SCHEMA_CONTEXT = 'http://schema.org'
 
 
-def log():  # pragma: no cover
-    """Logger, is loaded on first use.
+def cached_link(request, obj, *args):
+    """Return request.link(obj, *args), cached on the request.
 
-    Thus we make sure it is loaded after our config is loaded.
+    Links are cached by object identity for the lifetime of the request.
+    The object is kept in the cache, so its id can not be reused.
+    """
+    try:
+        cache = request._link_cache
+    except AttributeError:
+        cache = request._link_cache = {}
+    key = (id(obj),) + args
+    try:
+        return cache[key][1]
+    except KeyError:
+        link = request.link(obj, *args)
+        cache[key] = (obj, link)
+        return link
+
+
+def include_children(request):
+    """Return if the children parameter is set on the request.
+
+    The result is cached on the request, so the request parameters are
+    only looked up once per request.
     """
-    return logging.getLogger(__name__)
+    try:
+        return request._include_children
+    except AttributeError:
+        children = request._include_children = bool(
+            request.params.get('children'))
+        return children
 
 
 class Resource(object):
@@ -28,13 +53,19 @@ class Resource(object):
     schema_type = 'Thing'
 
     def dump_json(self, request, root=True):
-        json = {
-            '@type': self.schema_type,
-            '@id': request.link(self)
-        }
+        return self._add_json_ld({}, request, root)
+
+    def _add_json_ld(self, json, request, root):
+        """Add the schema type, id and context to json and return it.
+
+        Subclasses pass in their own json dict, so only one dict is
+        created per dumped object.
+        """
+        json['@type'] = self.schema_type
+        json['@id'] = cached_link(request, self)
         if root:
             # Only add the context if this is a root object.
-            json.update({'@context': 'http://schema.org'})
+            json['@context'] = SCHEMA_CONTEXT
         return json
 
     @classmethod
@@ -63,29 +94,32 @@ class DocumentCollection(BTree, Resource):
         """
         # Do not try and show the whole tree, as this gives problems with
         # linking to the correct children objects.
-        if root and request.params.get('children'):
+        if root and include_children(request):
             def item_function(document):
                 return document.dump_json(request, False)
         else:
             def item_function(document):
                 return {
-                    '@id': request.link(document),
+                    '@id': cached_link(request, document),
                     '@type': document.schema_type,
                 }
+        # Iterate over the BTree buckets lazily, without building an
+        # intermediate sequence of all values.
+        items = []
+        append = items.append
+        for document in self.itervalues():
+            append(item_function(document))
         json = {
-            'itemListElement': [item_function(v) for v in self.values()],
+            'itemListElement': items,
         }
         if root:
-            json.update({
-                'websocket': {
-                    '@type': 'url',
-                    '@value': request.link(Websocket(self))
-                    # Temporary solution, till link_prefix works.
-                    .replace('http', 'ws').replace('5000', '8080')
-                },
-            })
-        json.update(super().dump_json(request, root))
-        return json
+            json['websocket'] = {
+                '@type': 'url',
+                '@value': request.link(Websocket(self))
+                # Temporary solution, till link_prefix works.
+                .replace('http', 'ws').replace('5000', '8080')
+            }
+        return self._add_json_ld(json, request, root)
 
 
 class SaladCollection(DocumentCollection):
@@ -103,11 +137,10 @@ class CommentCollection(DocumentCollection):
 class Document(persistent.Persistent, Resource):
     def __init__(self):
         super().__init__()
-        self.id = shortuuid.uuid()
+        self.id = uuid.uuid4().hex
 
     @classmethod
     def is_valid_json(cls, json):
-        log = logging.getLogger(__name__)
         log.debug('Validating abject of type [ %s ]', cls.__name__)
         schema_type = json.get('@type', json.get('type', ''))
         if schema_type.lower() != cls.schema_type.lower():
@@ -120,10 +153,10 @@ class Document(persistent.Persistent, Resource):
         # If if children parameter is set and
         # this is the root object return whole attribute, not just a
         # reference.
-        if root and request.params.get('children'):
+        if root and include_children(request):
             return getattr(self, attribute).dump_json(request, False)
         else:
-            return {'@id': request.link(self, attribute),
+            return {'@id': cached_link(request, self, attribute),
                     '@type': getattr(self, attribute).schema_type}
 
 
@@ -131,6 +164,8 @@ class SaladDocument(Document):
     """The salad."""
 
     def __init__(self, start_time, location=None):
+        # Imported on first use, so importing the model stays cheap.
+        from dateutil import tz
         super().__init__()
         if start_time.tzinfo is None:
             raise ValueError('Missing timezone data on start_time.')
@@ -142,38 +177,48 @@ class SaladDocument(Document):
     schema_type = 'FoodEvent'
 
     @classmethod
-    def is_valid_json(cls, json):
-        log = logging.getLogger(__name__)
-        if not super().is_valid_json(json):
-            return False
-        date = json.get('startDate')
+    def _parse_start_date(cls, json):
+        """Return the parsed startDate of json.
+
+        Returns None if startDate is missing, can not be parsed or is
+        missing timezone data.
+        """
+        import iso8601
         try:
-            date = iso8601.parse_date(date, default_timezone=None)
+            date = iso8601.parse_date(json.get('startDate'),
+                                      default_timezone=None)
         except iso8601.ParseError as e:
             log.debug('Could not parse date: %s.', e)
-            return False
+            return None
         if date.tzinfo is None:
             log.debug('startDate is missing timezone.')
+            return None
+        return date
+
+    @classmethod
+    def is_valid_json(cls, json):
+        if not super().is_valid_json(json):
             return False
-        return True
+        return cls._parse_start_date(json) is not None
 
     @classmethod
     def load_json(cls, json, request=None):
-        if cls.is_valid_json(json):
-            start_time = iso8601.parse_date(json['startDate'],
-                                            default_timezone=None)
-            return cls(start_time=start_time,
-                       location=json.get('location', '').strip() or None)
+        # Validate and parse the startDate in a single pass.
+        if super().is_valid_json(json):
+            start_time = cls._parse_start_date(json)
+            if start_time is not None:
+                return cls(start_time=start_time,
+                           location=json.get('location', '').strip() or None)
         return super(SaladDocument, cls).load_json(json, request)
 
     def dump_json(self, request, root=True):
         json = {
-            'startDate': self.start_time.isoformat(),
+            # The json encoder writes datetimes in ISO 8601 format.
+            'startDate': self.start_time,
             'location': self.location,
             'ingredients': self._dump_json_attr('ingredients', request, root)
         }
-        json.update(super().dump_json(request, root))
-        return json
+        return self._add_json_ld(json, request, root)
 
 
 class IngredientDocument(Document):
@@ -188,54 +233,61 @@ class IngredientDocument(Document):
 
     schema_type = 'Offer'
 
+    # Templates of the seller and itemOffered json, copied on dump.
+    _seller_template = {'@type': 'Person', 'name': None}
+    _item_offered_template = {'@type': 'Product', 'name': None}
+
     @classmethod
-    def is_valid_json(cls, json):
-        if not super().is_valid_json(json):
-            return False
+    def _parse_names(cls, json):
+        """Return the stripped product name and seller name of json.
+
+        Returns None if one of them is missing or empty.
+        """
+        names = []
         # The name and seller values must be filled.
         for name, type_ in (('name', 'Product'), ('seller', 'Person')):
-            if not name in json:
-                return False
-            value = json.get(name)
-            if isinstance(value, str):
-                if not value.strip():
-                    return False
-            elif hasattr(value, 'get'):
+            if name not in json:
+                return None
+            value = json[name]
+            if hasattr(value, 'get'):
                 json_type = value.get('@type', value.get('type', type_))
                 if json_type.lower() != type_.lower():
-                    return False
-                if not value.get('name', '').strip():
-                    return False
-            else:
-                return False
-        return True
+                    return None
+                value = value.get('name', '')
+            elif not isinstance(value, str):
+                return None
+            value = value.strip()
+            if not value:
+                return None
+            names.append(value)
+        return names
+
+    @classmethod
+    def is_valid_json(cls, json):
+        if not super().is_valid_json(json):
+            return False
+        return cls._parse_names(json) is not None
 
     @classmethod
     def load_json(cls, json, request=None):
-        if cls.is_valid_json(json):
-            name = json['name']
-            if not isinstance(name, str):
-                name = name['name']
-            owner = json['seller']
-            if not isinstance(owner, str):
-                owner = owner['name']
-            return cls(name=name.strip(),
-                       owner=owner.strip())
+        # Validate and parse the names in a single pass.
+        if super().is_valid_json(json):
+            names = cls._parse_names(json)
+            if names is not None:
+                name, owner = names
+                return cls(name=name, owner=owner)
         return super(IngredientDocument, cls).load_json(json, request)
 
     def dump_json(self, request, root=True):
+        seller = self._seller_template.copy()
+        seller['name'] = self.owner
+        item_offered = self._item_offered_template.copy()
+        item_offered['name'] = self.name
         json = {
-            'seller': {
-                '@type': 'Person',
-                'name': self.owner,
-            },
-            'itemOffered': {
-                '@type': 'Product',
-                'name': self.name,
-            }
+            'seller': seller,
+            'itemOffered': item_offered,
         }
-        json.update(super().dump_json(request, root))
-        return json
+        return self._add_json_ld(json, request, root)
 
 
 class CommentDocument(Document):
@@ -258,8 +310,7 @@ class RootDocument(Document):
                 '@value': request.link(Websocket(self))
             },
         }
-        json.update(super().dump_json(request, root))
-        return json
+        return self._add_json_ld(json, request, root)
 
 
 class Websocket(object):
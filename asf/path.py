@@ -6,6 +6,8 @@ from . import model
 
 import webob
 
+log = logging.getLogger(__name__)
+
 
 @app.RootApp.path(model=model.RootDocument, path='')
 def get_root_path(request):
@@ -47,7 +49,6 @@ def mount_websocket(request):
 
 @app.WebsocketApp.link_prefix()
 def websocket_link_prefix(request):
-    log = logging.getLogger(__name__)
     log.debug('Linking websocket')
     # Create a new request object which we will use to set the right
     # values for our websocket settings.
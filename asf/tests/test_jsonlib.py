@@ -0,0 +1,32 @@
+import datetime
+
+from dateutil import tz
+
+import pytest
+
+from asf import jsonlib
+
+
+@pytest.mark.parametrize('obj', [
+    {'error': 'Message is not json loadable.'},
+    {'function': 'ls', 'paths': ['/api/a', '/api/b']},
+    [],
+    'hello',
+])
+def test_dumps_loads(obj):
+    data = jsonlib.dumps(obj)
+    assert isinstance(data, bytes)
+    assert jsonlib.loads(data) == obj
+    assert jsonlib.loads(data.decode('utf-8')) == obj
+
+
+def test_dumps_datetime():
+    date = datetime.datetime(2017, 3, 4, 22, 26, tzinfo=tz.tzutc())
+    assert jsonlib.loads(jsonlib.dumps({'date': date})) == \
+        {'date': date.isoformat()}
+
+
+@pytest.mark.parametrize('data', ['not json', b'not json', b'\xff'])
+def test_loads_error(data):
+    with pytest.raises(jsonlib.JSONDecodeError):
+        jsonlib.loads(data)
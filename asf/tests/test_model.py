@@ -8,6 +8,7 @@ import iso8601
 
 import pytest
 
+from asf import jsonlib
 from asf import model
 
 
@@ -15,7 +16,37 @@ class MockRequest(mock.MagicMock):
     def __init__(self, **kwargs):
         if 'params' not in kwargs:
             kwargs['params'] = {}
+        kwargs.setdefault('_link_cache', {})
         super().__init__(link=mock.MagicMock(), **kwargs)
+        # Computed and cached on first use by model.include_children.
+        del self._include_children
+
+
+def test_cached_link():
+    request = MockRequest()
+    # Return a new link on every call, so a cached link can be told apart.
+    request.link.side_effect = lambda *args: object()
+    obj = object()
+    link = model.cached_link(request, obj)
+    assert model.cached_link(request, obj) is link
+    assert model.cached_link(request, obj, 'name') is not link
+    assert model.cached_link(request, obj, 'name') is \
+        model.cached_link(request, obj, 'name')
+    # request.link is only called once per object and arguments.
+    assert request.link.call_args_list == [mock.call(obj),
+                                           mock.call(obj, 'name')]
+
+
+@pytest.mark.parametrize('params, children', [
+    ({}, False),
+    ({'children': ''}, False),
+    ({'children': 'true'}, True),
+])
+def test_include_children(params, children):
+    request = MockRequest(params=params)
+    assert model.include_children(request) is children
+    request.params = {}
+    assert model.include_children(request) is children
 
 
 class TestResource:
@@ -198,7 +229,8 @@ class TestSaladDocument(TestDocument):
         resource = self.resource()
         request = MockRequest()
         json = resource.dump_json(request)
-        iso8601.parse_date(json['startDate'])
+        start_date = jsonlib.loads(jsonlib.dumps(json['startDate']))
+        assert iso8601.parse_date(start_date) == resource.start_time
         assert not json['location']
         ingredients = json['ingredients']
         assert ingredients['@type'] == resource.ingredients.schema_type
@@ -208,7 +240,8 @@ class TestSaladDocument(TestDocument):
         location = 'somewhere'
         resource = self.resource(location=location)
         json = resource.dump_json(MockRequest())
-        iso8601.parse_date(json['startDate'])
+        start_date = jsonlib.loads(jsonlib.dumps(json['startDate']))
+        assert iso8601.parse_date(start_date) == resource.start_time
         assert json['location'] == location
 
     def test_dump_json_with_children(self):
@@ -13,6 +13,13 @@ import websockets
 from asf import websocket
 
 
+@pytest.fixture
+def valid_paths():
+    websocket.clear_valid_paths()
+    yield
+    websocket.clear_valid_paths()
+
+
 @pytest.mark.parametrize('path, status_code, result', [
     ('api/hello', 200, True),
     ('/api/hello', 200, True),
@@ -27,7 +34,7 @@ from asf import websocket
     ('/api/hello', 302, True),
     ('/hello', 200, False),
 ])
-def test_is_valid_app_path(config, requests_mocker,
+def test_is_valid_app_path(event_loop, config, requests_mocker, valid_paths,
                            path, status_code, result):
     host = '127.0.0.1'
     port = 5002
@@ -35,7 +42,56 @@ def test_is_valid_app_path(config, requests_mocker,
     config['port'] = port
     requests_mocker.get('http://{}:{}/{}'.format(host, port, path.lstrip('/')),
                         status_code=status_code)
-    assert(websocket.is_valid_app_path(path) is result)
+    valid = event_loop.run_until_complete(
+        websocket.is_valid_app_path(path, loop=event_loop))
+    assert(valid is result)
+
+
+def test_is_valid_app_path_cached(event_loop, config, requests_mocker,
+                                  valid_paths):
+    host = '127.0.0.1'
+    port = 5002
+    config['host'] = host
+    config['port'] = port
+    url = 'http://{}:{}/api/hello'.format(host, port)
+    requests_mocker.get(url, status_code=200)
+    for _ in range(2):
+        assert event_loop.run_until_complete(
+            websocket.is_valid_app_path('/api/hello', loop=event_loop))
+    assert requests_mocker.call_count == 1
+    assert requests_mocker.last_request.timeout == websocket.VALIDATE_TIMEOUT
+    websocket.clear_valid_paths()
+    assert event_loop.run_until_complete(
+        websocket.is_valid_app_path('/api/hello', loop=event_loop))
+    assert requests_mocker.call_count == 2
+
+
+def test_is_valid_app_path_timeout(event_loop, config, requests_mocker,
+                                   valid_paths):
+    import requests
+    host = '127.0.0.1'
+    port = 5002
+    config['host'] = host
+    config['port'] = port
+    url = 'http://{}:{}/api/hello'.format(host, port)
+    requests_mocker.get(url, exc=requests.exceptions.ConnectTimeout)
+    assert not event_loop.run_until_complete(
+        websocket.is_valid_app_path('/api/hello', loop=event_loop))
+
+
+def test_lru_set():
+    lru = websocket._LRUSet(maxsize=2)
+    lru.add('a')
+    lru.add('b')
+    # Using 'a' makes 'b' the least recently used item.
+    assert 'a' in lru
+    lru.add('c')
+    assert len(lru) == 2
+    assert 'a' in lru
+    assert 'b' not in lru
+    assert 'c' in lru
+    lru.clear()
+    assert len(lru) == 0
 
 
 @pytest.mark.parametrize('in_path, origin, out_path', [
@@ -154,7 +210,7 @@ class Server:
     def start(self, host, port, pubsub):
         self._running = True
         self.pubsub = pubsub
-        handler = websocket.handler_factory(pubsub, loop=self._loop)
+        handler = websocket.handler_factory(lambda: pubsub, loop=self._loop)
         server = websockets.serve(handler, host=host, port=port,
                                   loop=self._loop)
         self.server = self._loop.run_until_complete(server)
@@ -195,22 +251,29 @@ class MockAsyncPubSub(object):
         self._internal_queue = asyncio.Queue(loop=self._loop)
         # This queue is can be used to get values by external programs.
         self.queue = asyncio.Queue(loop=self._loop)
-
-    async def subscribe(self, path):
-        print('Mock subscribing to :', path)
-        message = {'type': 'subscribe',
-                   'channel': path.encode('utf-8')}
-        await self.queue.put(message)
-        await self._internal_queue.put(message)
-
-    async def unsubscribe(self, path=None):
-        if not path:
-            path = 'ALL'
-        print('Mock unsubscribing to :', path)
-        message = {'type': 'unsubscribe',
-                   'channel': path.encode('utf-8')}
-        await self.queue.put(message)
-        await self._internal_queue.put(message)
+        self.closed = False
+
+    async def subscribe(self, *paths):
+        for path in paths:
+            print('Mock subscribing to :', path)
+            message = {'type': 'subscribe',
+                       'channel': path.encode('utf-8')}
+            await self.queue.put(message)
+            await self._internal_queue.put(message)
+
+    async def unsubscribe(self, *paths):
+        if not paths:
+            paths = ['ALL']
+        for path in paths:
+            print('Mock unsubscribing to :', path)
+            message = {'type': 'unsubscribe',
+                       'channel': path.encode('utf-8')}
+            await self.queue.put(message)
+            await self._internal_queue.put(message)
+
+    def close(self):
+        print('Mock closing pubsub')
+        self.closed = True
 
     def send_message(self, message):
         self._internal_queue.put_nowait(message)
@@ -231,7 +294,7 @@ class TestWebSocketHandler:
         return 'http://{}:{}'.format(self.host, self.origin_port)
 
     @pytest.fixture(autouse=True)
-    def mock_is_valid_path(self, config, requests_mocker):
+    def mock_is_valid_path(self, config, requests_mocker, valid_paths):
         config['host'] = self.host
         config['port'] = self.origin_port
         matcher = re.compile(r'^{}'.format(self.origin))
@@ -288,6 +351,25 @@ class TestWebSocketHandler:
             assert result.pop('function') == function
             assert result == expected
 
+    def test_subscribe_ls_unsubscribe_paths(self, client, server):
+        server = server()
+        client = client(origin=self.origin)
+        paths = ['/api/here', '/api/there']
+        tests = [
+            ('subscribe', [{'path': path} for path in paths]),
+            ('ls', [{'paths': paths}]),
+            ('unsubscribe', [{'path': path} for path in paths]),
+            ('ls', [{'paths': []}]),
+        ]
+        for function, expected in tests:
+            message = {'function': function,
+                       'paths': ['api/here/', 'api/there']}
+            client.sync_send(json.dumps(message))
+            for expected_result in expected:
+                result = json.loads(client.sync_recv())
+                assert result.pop('function') == function
+                assert result == expected_result
+
     @pytest.mark.parametrize('data', [
         'hello',
     ])
@@ -309,6 +391,34 @@ class TestWebSocketHandler:
         assert result['type'] == type_
         assert result['data'] == data
 
+    @pytest.mark.parametrize('data, expected', [
+        (b'{}', {}),
+        (b' { } ', {}),
+        (b'5', {'data': 5}),
+        (b'"hello"', {'data': 'hello'}),
+        (b'[1, 2]', {'data': [1, 2]}),
+    ])
+    def test_listen_for_raw_message(self, client, server, data, expected):
+        path = '/a/path/s'
+        m = {'channel': path.encode('utf-8'), 'type': 'message',
+             'data': data}
+        server = server()
+        client = client('api', origin=self.origin)
+        server.pubsub.send_message(m)
+        result = json.loads(client.sync_recv())
+        assert result.pop('function') == 'message'
+        assert result.pop('path') == path
+        assert result == expected
+
+    @pytest.mark.parametrize('data', [b'hello', b'\xff'])
+    def test_listen_for_invalid_message(self, client, server, data):
+        m = {'channel': b'/a/path/s', 'type': 'message', 'data': data}
+        server = server()
+        client = client(origin=self.origin)
+        server.pubsub.send_message(m)
+        with pytest.raises(asyncio.TimeoutError):
+            client.sync_recv(timeout=0.2)
+
     def test_subscribe_invalid_path(self, client, server):
         server = server()
         client = client(origin=self.origin)
@@ -324,12 +434,27 @@ class TestWebSocketHandler:
     @pytest.mark.parametrize('message, error', [
         (json.dumps({'function': 'wrong'}),
          'Message function must be one of: {}.'.
-         format(', '.join(websocket.WebSocketHandler.functions))),
+         format(', '.join(sorted(websocket.WebSocketHandler.functions)))),
         (json.dumps({}), 'Message function must be one of: {}.'.
-         format(', '.join(websocket.WebSocketHandler.functions))),
+         format(', '.join(sorted(websocket.WebSocketHandler.functions)))),
         (json.dumps([]), 'Message must be a dict.'),
         ('not json', 'Message is not json loadable.'),
         (json.dumps({'function': 'subscribe'}), 'Message missing path.'),
+        (json.dumps({'function': 'subscribe', 'paths': 'api/path'}),
+         'Message paths must be a non-empty list of strings.'),
+        (json.dumps({'function': 'subscribe', 'paths': []}),
+         'Message paths must be a non-empty list of strings.'),
+        (json.dumps({'function': 'subscribe', 'paths': [None]}),
+         'Message paths must be a non-empty list of strings.'),
+        (json.dumps({'function': 'subscribe', 'paths': ['api/path', 1]}),
+         'Message paths must be a non-empty list of strings.'),
+        (json.dumps({'function': 'unsubscribe', 'paths': [['api/path']]}),
+         'Message paths must be a non-empty list of strings.'),
+        (json.dumps({'function': 'subscribe', 'path': None}),
+         'Message path must be a string.'),
+        (json.dumps({'function': 'subscribe', 'path': 'api/path',
+                     'paths': ['api/path']}),
+         'Message must have either path or paths, not both.'),
 
     ])
     def test_consumer_errors(self, client, server, message, error):
@@ -351,12 +476,11 @@ class TestWebSocketHandler:
         assert exc.code == 4004
         assert exc.reason == 'Invalid path'
 
-    def test_unsubscribe_on_close(self, client, server):
+    def test_close_pubsub_on_close(self, client, server):
         server = server()
         client = client(origin=self.origin)
         server.stop()
-        message = server.pubsub.queue.get_nowait()
-        assert message == {'type': 'unsubscribe', 'channel': b'ALL'}
+        assert server.pubsub.closed
 
     def test_listen_empty_message(self, client, server):
         server = server()
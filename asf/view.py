@@ -1,9 +1,24 @@
-import json
 import logging
 
+import morepath
+
 from . import app as app_module
+from . import jsonlib
 from . import model
 
+log = logging.getLogger(__name__)
+
+
+def render_json(content, request):
+    """Render content as a json response.
+
+    Like :func:`morepath.render_json`, but the content is encoded with
+    :mod:`asf.jsonlib` instead of the standard library json module.
+    """
+    return morepath.Response(
+        body=jsonlib.dumps(request.app._dump_json(content, request)),
+        content_type='application/json')
+
 
 # @app_module.App.view(model=model.Root)
 # def view_root(self, request):
@@ -13,16 +28,16 @@ from . import model
 #     ))
 
 
-@app_module.ResourceApp.json(model=model.Resource)
+@app_module.ResourceApp.json(model=model.Resource, render=render_json)
 def view_json_resource(self, request):
     return self
 
 
 @app_module.ResourceApp.json(model=model.DocumentCollection,
                              request_method='POST',
-                             body_model=model.Document)
+                             body_model=model.Document,
+                             render=render_json)
 def create_document(self, request):
-    log = logging.getLogger(__name__)
     resource = self.add(request.body_obj)
 
     def redis_publish(response):
@@ -31,7 +46,7 @@ def create_document(self, request):
         log.debug('Publishing obj %r to redis', resource)
         data = {'data': resource.dump_json(request),
                 'type': 'CREATE'}
-        request.app.root.redis.publish(request.path, json.dumps(data))
+        request.app.root.redis.publish(request.path, jsonlib.dumps(data))
     request.after(redis_publish)
     return request.view(resource)
 
@@ -40,14 +55,12 @@ def create_document(self, request):
 
 @app_module.ResourceApp.defer_links(model=model.Websocket)
 def defer_websocket_links(app, obj):
-    log = logging.getLogger(__name__)
     log.debug('defering obj %r in app %r.', obj, app)
     return app.child(app_module.WebsocketApp())
 
 
 @app_module.RootApp.defer_links(model=model.SaladCollection)
 def defer_salad_collection_links(app, obj):
-    log = logging.getLogger(__name__)
     log.debug('defering obj %r in app %r.', obj, app)
     return app.child(app_module.SaladsApp(obj.parent))
 
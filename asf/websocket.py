@@ -1,29 +1,33 @@
 import asyncio
 from asyncio.futures import CancelledError
-import json
+from collections import OrderedDict
+import functools
 import logging
 from urllib import parse
 
 import aredis
 from aredis.pubsub import PubSub
 
-import requests
-
 import websockets
 
 from .config import config, load_config
+from . import jsonlib
+
+log = logging.getLogger(__name__)
 
 
-def handler_factory(pubsub, *, loop=None):
+def handler_factory(pubsub_factory, *, loop=None):
     """Create a async handler for the websocket server.
 
-    This allows for setting the pubsub class (usefull for testing).
+    pubsub_factory is called to create a new pubsub for every websocket
+    connection, so every connection has its own redis connection. This
+    also allows for setting the pubsub class (usefull for testing).
     """
-    log = logging.getLogger(__name__)
 
     async def handler(websocket, path):
         """Async websocket handler."""
         log.debug('Creating new websocket.')
+        pubsub = pubsub_factory()
         with WebSocketHandler(websocket, path, pubsub, loop=loop) as self:
             await self.handle()
 
@@ -36,10 +40,29 @@ class WebSocketHandler(object):
     One is created for every websocket connection.
     """
 
-    functions = ('ls', 'subscribe', 'unsubscribe')
+    functions = frozenset(('ls', 'subscribe', 'unsubscribe'))
+
+    # Constant error messages, json encoded only once.
+    _not_json_error = jsonlib.dumps(
+        {'error': 'Message is not json loadable.'}).decode('utf-8')
+    _not_dict_error = jsonlib.dumps(
+        {'error': 'Message must be a dict.'}).decode('utf-8')
+    _function_error = jsonlib.dumps(
+        {'error': 'Message function must be one of: {}.'.
+         format(', '.join(sorted(functions)))}).decode('utf-8')
+    _missing_path_error = jsonlib.dumps(
+        {'error': 'Message missing path.'}).decode('utf-8')
+    _path_and_paths_error = jsonlib.dumps(
+        {'error': 'Message must have either path or paths, not both.'}
+    ).decode('utf-8')
+    _path_not_str_error = jsonlib.dumps(
+        {'error': 'Message path must be a string.'}).decode('utf-8')
+    _invalid_paths_error = jsonlib.dumps(
+        {'error': 'Message paths must be a non-empty list of strings.'}
+    ).decode('utf-8')
 
     def __init__(self, websocket, path, pubsub, *, loop=None):
-        self.log = logging.getLogger(__name__)
+        self.log = log
         self.log.debug('init')
         self._loop = loop
         self.log.debug('websocket path: %s', path)
@@ -49,27 +72,17 @@ class WebSocketHandler(object):
         self.origin = self.websocket.request_headers['origin'] or ''
         self.log.debug('Origin: %r', self.origin)
         self.subscriptions = set()
-        # A lock wich will lock till for ever. Used to have the producer
-        # in waiting state if no message was recieved from redis server.
-        self._lock = self._loop.create_future()
-        self.tasks = []
-        # Redis connect, make sure we have a pool.
+        # Set when a path is subscribed to. Used to have the producer
+        # in waiting state while the pubsub has nothing to listen to.
+        self._subscribed = asyncio.Event(loop=self._loop)
+        # The running tasks, only changed when a task is created or done.
+        self.tasks = set()
+        # The pubsub of this connection.
         self.pubsub = pubsub
         path = path.rstrip('/')
         if path.endswith('/ws'):
             path = path[:-3]
-        if not is_valid_app_path(path):
-            # If path is invalid, close connection.
-            self.log.debug('Invalid path closing connection.')
-            asyncio.ensure_future(websocket.close(4004, 'Invalid path'),
-                                  loop=self._loop)
-            return
-        # Don't try to subscribe to the main '/api' url.
-        if path != '/api':
-            asyncio.ensure_future(
-                self.subscribe({'path': path}),
-                loop=self._loop
-            )
+        self.path = path
         self.log.debug('init done')
 
     def __enter__(self):
@@ -77,18 +90,13 @@ class WebSocketHandler(object):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         # Clean-up.
+        # Cancel all tasks.
+        for task in self.tasks:
+            task.cancel()
+        # Close the pubsub of this connection, this closes its redis
+        # connection which drops all subscriptions.
         try:
-            # Close lock.
-            self._lock.set_result(None)
-            # Cancel all tasks.
-            [t.cancel() for t in self.tasks]
-            # Unsubscribe to all subscriptions.
-            asyncio.wait_for(
-                asyncio.ensure_future(
-                    self.pubsub.unsubscribe(), loop=self._loop
-                ),
-                None, loop=self._loop
-            )
+            self.pubsub.close()
         except Exception as e:  # pragma: no cover
             self.log.exception('Clean-up failed: %s', e)
         if exc_type:
@@ -104,11 +112,25 @@ class WebSocketHandler(object):
 
     async def handle(self):
         self.log.debug('handlingen')
+        if not await is_valid_app_path(self.path, loop=self._loop):
+            # If path is invalid, close connection.
+            self.log.debug('Invalid path closing connection.')
+            await self.websocket.close(4004, 'Invalid path')
+            return
+        # Don't try to subscribe to the main '/api' url.
+        if self.path != '/api':
+            await self.subscribe({'path': self.path})
+        consumer_task = None
+        producer_task = None
         while True:
-            self.tasks.append(asyncio.ensure_future(self.consumer(),
-                                                    loop=self._loop))
-            self.tasks.append(asyncio.ensure_future(self.producer(),
-                                                    loop=self._loop))
+            # Only recreate the tasks that are done, a pending task is
+            # kept running till it completes.
+            if consumer_task is None:
+                consumer_task = self._create_task(self.consumer())
+                self.tasks.add(consumer_task)
+            if producer_task is None:
+                producer_task = self._create_task(self.producer())
+                self.tasks.add(producer_task)
             # Wait for any of the tasks to be done.
             done, pending = await asyncio.wait(
                 self.tasks,
@@ -117,6 +139,11 @@ class WebSocketHandler(object):
             self.log.debug('Done tasks: %s.', done)
             self.log.debug('Pending tasks: %s.', pending)
             for task in done:
+                self.tasks.discard(task)
+                if task is consumer_task:
+                    consumer_task = None
+                else:
+                    producer_task = None
                 try:
                     func, message = task.result()
                 except CancelledError:
@@ -124,9 +151,18 @@ class WebSocketHandler(object):
                 self.log.debug('running function %s on message %s',
                                func, message)
                 await func(message)
-            for task in pending:
-                task.cancel()
-            self.tasks = []
+
+    def _create_task(self, coro):
+        task = asyncio.ensure_future(coro, loop=self._loop)
+        task.add_done_callback(_retrieve_exception)
+        return task
+
+    async def send_json(self, message):
+        """Send message json encoded over the websocket.
+
+        The message is send as a text frame, as the browser expects text.
+        """
+        await self.websocket.send(jsonlib.dumps(message).decode('utf-8'))
 
     async def consumer(self):
         message = await self.websocket.recv()
@@ -136,77 +172,100 @@ class WebSocketHandler(object):
     async def _consumer(self, message):
         self.log.debug('Running consumer on message %s', message)
         try:
-            message = json.loads(message)
-        except Exception:
-            await self.websocket.send(json.dumps(
-                {'error': 'Message is not json loadable.'}
-            ))
+            message = jsonlib.loads(message)
+        except jsonlib.JSONDecodeError:
+            await self.websocket.send(self._not_json_error)
             return
         if not hasattr(message, 'get'):
-            await self.websocket.send(json.dumps(
-                {'error': 'Message must be a dict.'}
-            ))
+            await self.websocket.send(self._not_dict_error)
             return
         function = message.get('function')
         if function not in self.functions:
-            await self.websocket.send(json.dumps(
-                {'error': 'Message function must be one of: {}.'.
-                 format(', '.join(self.functions))}
-            ))
+            await self.websocket.send(self._function_error)
             return
         self.log.debug('Running function %s', function)
         if function in ('subscribe', 'unsubscribe'):
-            if 'path' not in message:
-                await self.websocket.send(json.dumps(
-                    {'error': 'Message missing path.'}
-                ))
+            error = self._paths_error(message)
+            if error:
+                await self.websocket.send(error)
                 return
         await getattr(self, function)(message)
 
+    def _paths_error(self, message):
+        """Return the error message for invalid (un)subscribe paths.
+
+        Returns None if the message has either a "path" string or a
+        non-empty "paths" list of strings.
+        """
+        if 'path' in message:
+            if 'paths' in message:
+                return self._path_and_paths_error
+            if not isinstance(message['path'], str):
+                return self._path_not_str_error
+        elif 'paths' in message:
+            paths = message['paths']
+            if (not isinstance(paths, list) or not paths or
+                    not all(isinstance(path, str) for path in paths)):
+                return self._invalid_paths_error
+        else:
+            return self._missing_path_error
+        return None
+
     async def ls(self, message):
         message = {'function': 'ls',
                    'paths': sorted(self.subscriptions)}
-        await self.websocket.send(json.dumps(message))
+        await self.send_json(message)
 
     async def subscribe(self, message):
-        # redis subscribe
-        path = message['path']
-        path = parse_path(path, self.origin)
-        if path not in self.subscriptions:
-            if not is_valid_app_path(path):
+        # redis subscribe, all new paths are subscribed to at once.
+        paths = []
+        for path in _message_paths(message):
+            path = parse_path(path, self.origin)
+            if path in self.subscriptions or path in paths:
+                await self.send_json(
+                    {'function': 'subscribe',
+                     'error': 'Already subscribed to path: {}'.format(path)}
+                )
+                continue
+            if not await is_valid_app_path(path, loop=self._loop):
                 # If path is not valid, send en error message and
                 # do not subscribe to it.
-                await self.websocket.send(json.dumps(
+                await self.send_json(
                     {'error': 'Invalid path: {}'.format(path)}
-                ))
-                return
-            self.log.debug('Subscribing to path: %s', path)
-            await self.pubsub.subscribe(path)
-            self.subscriptions.add(path)
-            # self._subscriber.set_result(None)
-        else:
-            await self.websocket.send(json.dumps(
-                {'function': 'subscribe',
-                 'error': 'Already subscribed to path: {}'.format(path)}
-            ))
+                )
+                continue
+            paths.append(path)
+        if paths:
+            self.log.debug('Subscribing to paths: %s', paths)
+            await self.pubsub.subscribe(*paths)
+            self.subscriptions.update(paths)
+            self._subscribed.set()
 
     async def unsubscribe(self, message):
-        path = message['path']
-        path = parse_path(path, self.origin)
-        if path in self.subscriptions:
-            await self.pubsub.unsubscribe(path)
-            self.subscriptions.remove(path)
-        else:
-            await self.websocket.send(json.dumps(
-                {'function': 'unsubscribe',
-                 'error': 'Not subscribed to path: {}'.format(path)}
-            ))
+        # redis unsubscribe, all paths are unsubscribed from at once.
+        paths = []
+        for path in _message_paths(message):
+            path = parse_path(path, self.origin)
+            if path in self.subscriptions and path not in paths:
+                paths.append(path)
+            else:
+                await self.send_json(
+                    {'function': 'unsubscribe',
+                     'error': 'Not subscribed to path: {}'.format(path)}
+                )
+        if paths:
+            await self.pubsub.unsubscribe(*paths)
+            self.subscriptions.difference_update(paths)
 
     async def producer(self):
         message = await self.pubsub.listen()
-        if not message:
-            # Not subscribed yet, just lock till a task is done.
-            await self._lock
+        while not message:
+            # The pubsub returns directly if it is not subscribed to any
+            # channel, so do not poll it but wait till we subscribe to a
+            # path.
+            self._subscribed.clear()
+            await self._subscribed.wait()
+            message = await self.pubsub.listen()
         self.log.debug('Message from redis server: %r', message)
         return self._producer, message
 
@@ -224,24 +283,67 @@ class WebSocketHandler(object):
         if function == 'message':
             data = r_message['data']
             if isinstance(data, bytes):
-                data = data.decode('utf-8')
-            data = json.loads(data)
-            w_message.update({'data': data['data'],
-                             'type': data['type']})
+                try:
+                    data = data.decode('utf-8')
+                except UnicodeDecodeError:
+                    self.log.warning('Message on %s is not utf-8.', path)
+                    return
+            data = data.strip()
+            if data.startswith('{') and not data[1:].lstrip().startswith('}'):
+                # The published data is already a json object holding
+                # the data and type, so add the function and path to it
+                # without decoding and encoding it again.
+                w_message = '{{"function":"message","path":{},{}'.format(
+                    jsonlib.dumps(path).decode('utf-8'), data[1:])
+                self.log.debug('Message send over websocket: %s',
+                               w_message)
+                await self.websocket.send(w_message)
+                return
+            # Not a (non-empty) json object, decode and check it.
+            try:
+                data = jsonlib.loads(data)
+            except jsonlib.JSONDecodeError:
+                self.log.warning('Message on %s is not json: %r', path, data)
+                return
+            # An empty json object has nothing to add.
+            if data != {}:
+                w_message['data'] = data
         self.log.debug('Message send over websocket: %s',
                        w_message)
-        await self.websocket.send(json.dumps(w_message))
+        await self.send_json(w_message)
+
 
+def _message_paths(message):
+    """Return the paths of a (un)subscribe message.
 
+    A message contains either a single "path" or a non-empty list of
+    "paths", see WebSocketHandler._paths_error.
+    """
+    if 'path' in message:
+        return [message['path']]
+    return message['paths']
+
+
+def _retrieve_exception(task):
+    """Done callback which retrieves the exception of a task.
+
+    This makes sure an exception of a task which result is never
+    retrieved, is not logged as "never retrieved".
+    """
+    if not task.cancelled():
+        task.exception()
+
+
+@functools.lru_cache(maxsize=1024)
 def parse_path(path, origin):
     """Only return the path part of an url.
 
     Path may be only the path part of the url or an url starting with
     origin.
     All paths are returned as an absolute path. Any ending slashes are
-    removed.
+    removed. Results are cached, as the same paths are (un)subscribed
+    to over and over.
     """
-    log = logging.getLogger(__name__)
     origin = parse.urlparse(origin)
     log.debug('url parse origin: %r', origin)
     # Remove any slashes at the start and end of the path.
@@ -260,31 +362,89 @@ def parse_path(path, origin):
     return path
 
 
-def is_valid_app_path(path):
+class _LRUSet(object):
+    """A set holding at most maxsize items.
+
+    When full, adding an item drops the least recently used item.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __contains__(self, item):
+        if item in self._items:
+            self._items.move_to_end(item)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        self._items[item] = None
+        self._items.move_to_end(item)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+# Paths which are known to be valid. Documents are never removed, so
+# once a path is valid it stays valid.
+_valid_paths = _LRUSet(maxsize=1024)
+
+# Timeout in seconds of the http request validating a path.
+VALIDATE_TIMEOUT = 5
+
+
+def clear_valid_paths():
+    """Clear the cache of known valid app paths."""
+    _valid_paths.clear()
+
+
+async def is_valid_app_path(path, *, loop=None):
     """Check that the path is a existing app path.
 
     App paths shoud always start with "api" and should not return an
-    http error status.
+    http error status. The http request is done in an executor, so the
+    event loop is not blocked, and valid paths are cached. A path is
+    not valid if the request fails or times out.
     """
     # Path must start with 'api'.
-    log = logging.getLogger(__name__)
     log.debug('Testing path %r', path)
-    if path.lstrip('/').startswith('api'):
-        url = 'http://{host}:{port}/{path}'.format(host=config['host'].get(),
-                                                   port=config['port'].get(),
-                                                   path=path.lstrip('/'))
-        # Use a local connection to try and connect to this url.
-        response = requests.get(url)
-        # If connection is succesful (status code lower than 400 or higher
-        # than 599 return True.
-        return not 400 <= response.status_code < 600
-    else:
+    if not path.lstrip('/').startswith('api'):
         log.debug('Path must start with "api" to be valid.')
-    return False
+        return False
+    path = path.lstrip('/')
+    if path in _valid_paths:
+        return True
+    url = 'http://{host}:{port}/{path}'.format(host=config['host'].get(),
+                                               port=config['port'].get(),
+                                               path=path)
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    # Imported on first use, requests is slow to import and only needed
+    # for paths that are not cached yet.
+    import requests
+    # Use a local connection to try and connect to this url.
+    try:
+        response = await loop.run_in_executor(
+            None, functools.partial(requests.get, url,
+                                    timeout=VALIDATE_TIMEOUT))
+    except requests.RequestException as e:
+        log.warning('Could not validate path %r: %s', path, e)
+        return False
+    # If connection is succesful (status code lower than 400 or higher
+    # than 599 return True.
+    if 400 <= response.status_code < 600:
+        return False
+    _valid_paths.add(path)
+    return True
 
 
 def setup(loop):
-    log = logging.getLogger(__name__)
     load_config()
     host = config['websocket']['host'].get()
     port = config['websocket']['port'].get()
@@ -292,7 +452,7 @@ def setup(loop):
     redis_client = aredis.StrictRedis.from_url(config['redis_uri'].get())
     # Test that we can connect to redis.
     redis_test = asyncio.ensure_future(redis_client.ping(), loop=loop)
-    handler = handler_factory(redis_client.pubsub(), loop=loop)
+    handler = handler_factory(redis_client.pubsub, loop=loop)
     server = websockets.serve(handler, host=host, port=port, loop=loop)
 
     futures = asyncio.wait(
@@ -314,7 +474,6 @@ def setup(loop):
 
 
 def run():  # pragma: no cover
-    log = logging.getLogger(__name__)
     log.debug('Getting default event loop')
     loop = asyncio.get_event_loop()
     setup(loop)